@@ -0,0 +1,210 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import pyarrow.parquet as pq
+import pyarrow as pa
+import tempfile
+import io
+import os
+from .minio import MinIO
+
+worker_minio = None
+
+def init_worker():
+    """
+    Initialize a worker process of the encoding pool.
+
+    Every worker process creates its own MinIO client, since the client of the parent process cannot be shared
+    across processes.
+
+    :return: None
+    """
+
+    global worker_minio
+
+    worker_minio = MinIO()
+
+def encode_worker(arrow_path, object_name):
+    """
+    Encode an Arrow IPC file to parquet and ingest it to MinIO server. Runs inside a worker process.
+
+    The Arrow IPC file is memory-mapped, so the record batches are read without copying or pickling. The file is
+    removed once the parquet object has been written.
+
+    :param arrow_path: The path of the Arrow IPC stream file written by the parent process.
+    :param object_name: The name of the object to ingest the data to.
+    :return: A tuple of the name of the object and whether it was put to MinIO server.
+    """
+
+    try:
+        with pa.memory_map(arrow_path, "r") as source:
+            table = pa.ipc.open_stream(source).read_all()
+
+            buffer = io.BytesIO()
+            pq.write_table(table, buffer, compression="snappy")
+            buffer.seek(0)
+
+        uploaded = worker_minio.put_object(
+            buffer=buffer,
+            object_name=object_name
+        )
+    finally:
+        os.remove(arrow_path)
+
+    return object_name, uploaded
+
+class EncodingPool:
+    def __init__(self):
+        """
+        Initialize EncodingPool object.
+
+        The following environment variables are used to configure the pool:
+
+        - ENCODE_WORKERS (default 1): number of worker processes. With 1 worker no pool is started and
+          encoding is done in the calling process.
+        - ENCODE_MAX_PENDING (default 2 * ENCODE_WORKERS): maximum number of batches waiting to be encoded,
+          to bound the memory used by the hand-off files.
+        - ENCODE_SHM_DIR (default /dev/shm if it exists, otherwise the temporary directory): directory used
+          for the Arrow IPC hand-off files. It must hold ENCODE_MAX_PENDING uncompressed batches of 10000 rows
+          at once. Docker limits /dev/shm to 64 MB by default, so raise it with --shm-size or point
+          ENCODE_SHM_DIR to a disk directory for wide tables.
+
+        The worker processes are started on the first submitted batch.
+
+        :raises ValueError: If ENCODE_WORKERS or ENCODE_MAX_PENDING is lower than 1.
+        :return: None
+        """
+
+        self.workers = int(os.getenv("ENCODE_WORKERS", "1"))
+        self.max_pending = int(os.getenv("ENCODE_MAX_PENDING", str(2 * self.workers)))
+
+        if self.workers < 1:
+            raise ValueError(f"ENCODE_WORKERS must be at least 1, got {self.workers}")
+
+        if self.max_pending < 1:
+            raise ValueError(f"ENCODE_MAX_PENDING must be at least 1, got {self.max_pending}")
+
+        if os.path.isdir("/dev/shm"):
+            self.shm_dir = os.getenv("ENCODE_SHM_DIR", "/dev/shm")
+        else:
+            self.shm_dir = os.getenv("ENCODE_SHM_DIR", tempfile.gettempdir())
+
+        self.executor = None
+        self.pending = set()
+        self.arrow_paths = {}
+        self.failed_uploads = []
+
+    @property
+    def enabled(self):
+        return self.workers > 1
+
+    def write_arrow_file(self, table):
+        """
+        Write given Arrow table to an Arrow IPC stream file in the shared memory directory.
+
+        :param table: A pyarrow.Table object to be written.
+        :return: The path of the written file.
+        """
+
+        fd, arrow_path = tempfile.mkstemp(suffix=".arrow", dir=self.shm_dir)
+        os.close(fd)
+
+        try:
+            with pa.OSFile(arrow_path, "wb") as sink:
+                with pa.ipc.new_stream(sink, table.schema) as writer:
+                    writer.write_table(table)
+        except Exception:
+            os.remove(arrow_path)
+            raise
+
+        return arrow_path
+
+    def submit(self, df, object_name):
+        """
+        Submit given pandas DataFrame to be encoded to parquet and ingested to MinIO server by a worker process.
+
+        The DataFrame is converted to Arrow in the calling process and handed off to the worker through a file in
+        the shared memory directory. If ENCODE_MAX_PENDING batches are already waiting, block until one is done.
+
+        :param df: A pandas DataFrame object to be encoded.
+        :param object_name: The name of the object to ingest the data to.
+        :return: None
+        """
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+
+        while len(self.pending) >= self.max_pending:
+            done, self.pending = wait(self.pending, return_when=FIRST_COMPLETED)
+            self.collect(done)
+
+        arrow_path = self.write_arrow_file(pa.Table.from_pandas(df))
+
+        try:
+            future = self.executor.submit(encode_worker, arrow_path, object_name)
+            self.pending.add(future)
+            self.arrow_paths[future] = arrow_path
+        except Exception:
+            os.remove(arrow_path)
+            raise
+
+    def collect(self, done):
+        """
+        Get the results of finished batches and record the objects whose upload failed in `self.failed_uploads`.
+
+        :param done: A set of finished futures.
+        :raises Exception: The first error raised by a worker process.
+        :return: None
+        """
+
+        for future in done:
+            self.arrow_paths.pop(future, None)
+            object_name, uploaded = future.result()
+            if not uploaded:
+                self.failed_uploads.append(object_name)
+
+    def wait_all(self):
+        """
+        Wait until all submitted batches have been encoded and ingested.
+
+        :raises Exception: The first error raised by a worker process.
+        :return: None
+        """
+
+        done = wait(self.pending).done
+        self.pending = set()
+
+        self.collect(done)
+
+    def reset(self):
+        """
+        Drop the submitted batches after an error and shut down the worker processes. Errors of the remaining
+        batches are ignored, and hand-off files left by batches that did not run are removed. The worker processes
+        are started again on the next submitted batch.
+
+        :return: None
+        """
+
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+        for arrow_path in self.arrow_paths.values():
+            if os.path.exists(arrow_path):
+                os.remove(arrow_path)
+
+        self.pending = set()
+        self.arrow_paths = {}
+        self.failed_uploads = []
+
+    def close(self):
+        """
+        Wait for all submitted batches and shut down the worker processes.
+
+        :return: None
+        """
+
+        try:
+            self.wait_all()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
@@ -1,9 +1,14 @@
 import pandas as pd
 import pyarrow.parquet as pq
+from sqlalchemy import MetaData, Table, Integer, select, text, func, and_, or_, type_coerce
+from sqlalchemy.types import NullType
 import pyarrow as pa
 import io
+import json
 from datetime import datetime
 from .minio import MinIO
+from .verification import Verification
+from .encoding import EncodingPool
 
 class Ingestion:
     def __init__(self, db):
@@ -16,6 +21,9 @@ class Ingestion:
         
         self.db = db
         self.minio = MinIO()
+        self.verification = Verification(db, self.minio)
+        self.encoding_pool = EncodingPool()
+        self.failed_uploads = []
         
     def convert_df_to_parquet(self, df):
         """
@@ -41,11 +49,206 @@ class Ingestion:
         :return: None
         """
         
-        self.minio.put_object(
+        uploaded = self.minio.put_object(
                 buffer=buffer,
                 object_name=object_name
         )
         
+        if not uploaded:
+            self.failed_uploads.append(object_name)
+    
+    def pop_failed_uploads(self):
+        """
+        Get the names of the objects whose upload to MinIO server failed since the last call, from this process and
+        from the encoding pool.
+
+        :return: A list of object names.
+        """
+        
+        failed_uploads = self.failed_uploads + self.encoding_pool.failed_uploads
+        
+        self.failed_uploads = []
+        self.encoding_pool.failed_uploads = []
+        
+        return failed_uploads
+    
+    def encode_and_ingest(self, df, object_name):
+        """
+        Encode given pandas DataFrame to parquet and ingest it to MinIO server at the specified object name.
+
+        If the encoding pool is enabled (ENCODE_WORKERS > 1), the DataFrame is handed off to a worker process and
+        this method returns before the object is written; call `self.encoding_pool.wait_all()` to wait for it.
+
+        :param df: A pandas DataFrame object to be ingested.
+        :param object_name: The name of the object to ingest the data to.
+        :return: None
+        """
+        
+        if self.encoding_pool.enabled:
+            self.encoding_pool.submit(df, object_name)
+        else:
+            parquet_buffer = self.convert_df_to_parquet(df)
+            
+            self.ingest_to_minio(parquet_buffer, object_name)
+        
+    def throttle_batch(self, df, max_pause=None):
+        """
+        Account a batch read from the source database against the throttle of the database, sleeping if the
+        configured rows-per-second or bytes-per-second rate is exceeded.
+
+        :param df: A pandas DataFrame object read from the source database.
+        :param max_pause: The longest time to sleep, if a cursor is still open on the source.
+        :return: None
+        """
+        
+        throttle = self.db.impl.throttle
+        
+        if throttle.bytes_per_second:
+            nbytes = int(df.memory_usage(index=False, deep=True).sum())
+        else:
+            nbytes = 0
+        
+        throttle.consume(len(df), nbytes, max_pause)
+    
+    def reflect_table(self, table_name_query):
+        """
+        Reflect the given table from the database, through the throttle of the database.
+
+        :param table_name_query: The name of the table in the database, in the format "schema_name.table_name".
+        :return: A SQLAlchemy Table object.
+        """
+        
+        schema, table = table_name_query.split(".", 1)
+        
+        with self.db.impl.throttle.query() as connection:
+            return Table(table, MetaData(), schema=schema, autoload_with=connection)
+    
+    def get_key_bound(self, table):
+        """
+        Get a condition restricting the given table to the rows that exist when the load starts.
+
+        Only tables with a single integer primary key are supported: the condition is that the key is lower than or
+        equal to its current maximum, so rows inserted during the load are left out of both the load and the
+        verification.
+
+        :param table: A SQLAlchemy Table object.
+        :return: A SQL condition, or None if the table is not supported or is empty.
+        """
+        
+        key_columns = list(table.primary_key.columns)
+        
+        if len(key_columns) != 1 or not isinstance(key_columns[0].type, Integer):
+            return None
+        
+        with self.db.impl.throttle.query() as connection:
+            max_key = connection.execute(select(func.max(key_columns[0]))).scalar()
+        
+        if max_key is None:
+            return None
+        
+        quoted = self.db.impl.engine.dialect.identifier_preparer.quote(key_columns[0].name)
+        
+        return f"{quoted} <= {int(max_key)}"
+    
+    def keyset_condition(self, key_columns, last_values):
+        """
+        Build the condition selecting the rows after the given primary key values, in primary key order.
+
+        For a key (a, b) and last values (x, y) the condition is "a > x OR (a = x AND b > y)", which works on every
+        supported database, unlike row value comparison.
+
+        :param key_columns: A list of the primary key columns of the table.
+        :param last_values: A list of the primary key values of the last row read.
+        :return: A SQLAlchemy condition.
+        """
+        
+        conditions = []
+        
+        for index, column in enumerate(key_columns):
+            equals = [key_columns[i] == last_values[i] for i in range(index)]
+            conditions.append(and_(*equals, column > last_values[index]))
+        
+        return or_(*conditions)
+    
+    def read_batches(self, table, table_name_query, where_clause=None, batch_size=10000):
+        """
+        Read the given table from the database in batches, paced by the throttle of the database.
+
+        If the table has a primary key, every batch is a separate short query using keyset pagination on the
+        primary key, and the throttle sleeps between the queries with no cursor open on the source. Otherwise, the
+        rows are streamed with a server-side cursor where the driver supports it, and every pause is cut to
+        THROTTLE_MAX_CURSOR_PAUSE so the cursor is not dropped by the server.
+
+        In the keyset queries the typed table columns are only used for the ORDER BY and the keyset condition. The
+        selected columns are coerced to NullType, so no SQLAlchemy result processing is applied and both paths
+        return the raw driver values of a plain "SELECT *" (e.g. JSON as text on MySQL, UUID as string).
+
+        :param table: A SQLAlchemy Table object of the table.
+        :param table_name_query: The name of the table in the database to read from.
+        :param where_clause: An optional SQL condition restricting the rows.
+        :param batch_size: The number of rows in a batch.
+        :return: A generator of pandas DataFrame objects.
+        """
+        
+        throttle = self.db.impl.throttle
+        key_columns = list(table.primary_key.columns)
+        
+        if not key_columns:
+            query = f"SELECT * FROM {table_name_query}"
+            
+            if where_clause:
+                query += f" WHERE {where_clause}"
+            
+            with throttle.query() as connection:
+                connection.execution_options(stream_results=True)
+                
+                for df in pd.read_sql(query, connection, chunksize=batch_size):
+                    self.throttle_batch(df, throttle.max_cursor_pause)
+                    yield df
+            
+            return
+        
+        raw_columns = [type_coerce(column, NullType()).label(column.name) for column in table.c]
+        
+        last_values = None
+        
+        while True:
+            
+            statement = select(*raw_columns).select_from(table)
+            
+            if where_clause:
+                statement = statement.where(text(where_clause))
+            
+            if last_values is not None:
+                statement = statement.where(self.keyset_condition(key_columns, last_values))
+            
+            statement = statement.order_by(*key_columns).limit(batch_size)
+            
+            with throttle.query() as connection:
+                df = pd.read_sql(statement, connection)
+            
+            if not len(df):
+                return
+            
+            self.throttle_batch(df)
+            
+            yield df
+            
+            if len(df) < batch_size:
+                return
+            
+            last_values = []
+            
+            for column in key_columns:
+                value = df[column.name].iloc[-1]
+                
+                if isinstance(value, pd.Timestamp):
+                    value = value.to_pydatetime()
+                elif hasattr(value, "item"):
+                    value = value.item()
+                
+                last_values.append(value)
+    
     def parsing_schema_obj(self, obj_list):
         """
         Parse given list of dictionaries into a list of dictionaries containing object path and table name query
@@ -113,51 +316,108 @@ class Ingestion:
         
         If no data has been ingested to MinIO server for the given table, perform a full load. Otherwise, perform an
         incremental load by selecting data from the given table where the "updated_at" column's value is greater than or
-        equal to the current date.
+        equal to the current date and lower than the time the load started, both taken from the database clock. The
+        upper bound pins the loaded rows, so the verification after the load counts the same rows even if the table is
+        updated in between. The rows are read in batches with `read_batches` and written to a single object.
         
         :param object_path: The path of the object in MinIO server to ingest the data to.
         :param table_name_query: The name of the table in the database to load from.
-        :return: None
+        :return: A tuple of the list of object names written and the where clause used to select the rows.
         """
         
         get_obj_exists = self.minio.list_objects(object_path)
         
         if not get_obj_exists:
-            self.load_all(object_path, table_name_query)
+            return self.load_all(object_path, table_name_query)
         else:
-            df = pd.read_sql(f"SELECT * FROM {table_name_query} where updated_at >= '{datetime.now().strftime('%Y-%m-%d')}'", self.db.impl.engine)
+            with self.db.impl.throttle.query() as connection:
+                load_started_at = connection.exec_driver_sql("SELECT CURRENT_TIMESTAMP").scalar()
             
-            if not len(df):
-                pass
+            where_clause = f"updated_at >= '{load_started_at.strftime('%Y-%m-%d')}' " \
+                           f"AND updated_at < '{load_started_at.strftime('%Y-%m-%d %H:%M:%S')}'"
+            
+            table = self.reflect_table(table_name_query)
+            
+            df_list = list(self.read_batches(table, table_name_query, where_clause))
+            
+            if not df_list:
+                return [], where_clause
             else:
-                parquet_buffer = self.convert_df_to_parquet(df)
+                df = pd.concat(df_list, ignore_index=True)
                 
                 object_name = f"{object_path}{datetime.now().strftime('%Y%m%d')}.parquet"
                 
-                self.ingest_to_minio(parquet_buffer, object_name)
+                self.encode_and_ingest(df, object_name)
+                self.encoding_pool.wait_all()
+                
+                return [object_name], where_clause
     
     def load_all(self, object_path, table_name_query):
         """
         Perform a full load of the given table to MinIO server at the specified object path.
 
+        The rows are read in batches with `read_batches`, so the throttle of the database paces how fast they are
+        pulled from the source. For tables with a single integer primary key, the load is restricted to the rows
+        that exist when it starts (see `get_key_bound`).
+
         :param object_path: The path of the object in MinIO server where the data will be ingested to.
         :param table_name_query: The name of the table to load data from.
-        :return: None
+        :return: A tuple of the list of object names written and the where clause used to select the rows.
         """
         
-        df_list = pd.read_sql(f"SELECT * FROM {table_name_query}", self.db.impl.engine, chunksize=10000)
+        object_names = []
+        
+        table = self.reflect_table(table_name_query)
+        
+        where_clause = self.get_key_bound(table)
         
         count = 0
         
-        for df in df_list:
-            
-            parquet_buffer = self.convert_df_to_parquet(df)
+        for df in self.read_batches(table, table_name_query, where_clause):
             
             object_name = f"{object_path}{datetime.now().strftime('%Y%m%d')}_{count}.parquet"
             
-            self.ingest_to_minio(parquet_buffer, object_name)
+            self.encode_and_ingest(df, object_name)
+            object_names.append(object_name)
             count += 1
         
+        self.encoding_pool.wait_all()
+        
+        return object_names, where_clause
+    
+    def write_report(self, report):
+        """
+        Write the run report to MinIO server as a JSON object and print a summary of the verification results.
+
+        The report is written to "_reports/<run timestamp>.json" in the current bucket.
+
+        :param report: A dictionary containing the run start time and the list of per-table verification results.
+        :raises RuntimeError: If the report could not be written to MinIO server.
+        :return: The name of the report object.
+        """
+        
+        object_name = f"_reports/{report['run_started_at']}.json"
+        
+        buffer = io.BytesIO(json.dumps(report, indent=2, default=str).encode("utf-8"))
+        
+        uploaded = self.minio.put_object(buffer=buffer, object_name=object_name, content_type="application/json")
+        
+        failed = [table for table in report["tables"] if table["status"] != "ok"]
+        
+        if uploaded:
+            print(f"Checked {len(report['tables'])} tables, {len(failed)} failed. Report: {object_name}")
+        else:
+            print(f"Checked {len(report['tables'])} tables, {len(failed)} failed. Report could not be written to {object_name}")
+        
+        for table in failed:
+            print(f"{table['table']}: {table['status']} "
+                  f"(source={table['source_row_count']}, target={table['target_row_count']}, "
+                  f"missing={len(table['missing_objects'])})")
+        
+        if not uploaded:
+            raise RuntimeError(f"Failed to write run report {object_name}")
+        
+        return object_name
         
     def extract(self):
         """
@@ -166,16 +426,61 @@ class Ingestion:
         existence of a parquet file in the object storage. If the file exists, do an
         incremental load, otherwise do a full load.
 
+        If verification is enabled (VERIFY_LOAD), each loaded table is checked against its source after the load
+        and the results are written to a run report. A table whose load fails is recorded in the report with status
+        "error" and the run continues with the next table.
+
+        :raises RuntimeError: After the report is written, if a table has status "error", or status "mismatch" and
+        VERIFY_FAIL_ON_MISMATCH is enabled, so the process exits non-zero.
         :return: None
         """
         
+        report = {
+            "run_started_at": datetime.now().strftime('%Y%m%dT%H%M%S'),
+            "tables": []
+        }
+        
         table_stats_list = self.db.impl.get_load_status()
         
         schema_obj_list = self.parsing_schema_obj(table_stats_list)
         
-        for schema_obj in schema_obj_list:
-            
-            if schema_obj["incremental"]:
-                self.incremental_load(schema_obj["object_path"], schema_obj["table_name_query"])
-            else:
-                self.load_all(schema_obj["object_path"], schema_obj["table_name_query"])
\ No newline at end of file
+        try:
+            for schema_obj in schema_obj_list:
+                
+                try:
+                    if schema_obj["incremental"]:
+                        object_names, where_clause = self.incremental_load(schema_obj["object_path"], schema_obj["table_name_query"])
+                    else:
+                        object_names, where_clause = self.load_all(schema_obj["object_path"], schema_obj["table_name_query"])
+                except Exception as err:
+                    print(f"{schema_obj['table_name_query']}: {err}")
+                    
+                    self.encoding_pool.reset()
+                    self.pop_failed_uploads()
+                    
+                    result = self.verification.new_result(schema_obj["table_name_query"], [])
+                    result["status"] = "error"
+                    result["error"] = str(err)
+                    report["tables"].append(result)
+                    continue
+                    
+                failed_uploads = self.pop_failed_uploads()
+                    
+                if self.verification.enabled:
+                    report["tables"].append(
+                        self.verification.verify_table(
+                            schema_obj["table_name_query"], object_names, where_clause, failed_uploads
+                        )
+                    )
+        finally:
+            self.encoding_pool.close()
+        
+        if self.verification.enabled or report["tables"]:
+            self.write_report(report)
+        
+        failed_statuses = ["error", "mismatch"] if self.verification.fail_on_mismatch else ["error"]
+        
+        failed = [table["table"] for table in report["tables"] if table["status"] in failed_statuses]
+        
+        if failed:
+            raise RuntimeError(f"{len(failed)} tables failed: {', '.join(failed)}")
\ No newline at end of file
@@ -92,13 +92,48 @@ class MinIO:
             else:
                 print(err)
         
-    def put_object(self, buffer, object_name):
+    def stat_object(self, object_name):
+        """
+        Get the metadata of an object in the specified bucket in MinIO server without downloading its data.
+
+        :param object_name: The name of the object to stat.
+        :return: The object size in bytes, or None if the object does not exist.
+        """
+        
+        try:
+            return self.minio_client.stat_object(self.bucket, object_name).size
+        except S3Error as err:
+            if err.code not in ("NoSuchKey", "NoSuchObject"):
+                print(err)
+            return None
+    
+    def get_object_range(self, object_name, offset, length):
+        """
+        Read a byte range of an object in the specified bucket in MinIO server using a ranged GET.
+
+        :param object_name: The name of the object to read from.
+        :param offset: The start position of the range in bytes.
+        :param length: The number of bytes to read.
+        :return: A bytes object containing the requested range.
+        """
+        
+        response = self.minio_client.get_object(self.bucket, object_name, offset=offset, length=length)
+        
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+        
+    def put_object(self, buffer, object_name, content_type="application/vnd.apache.parquet"):
         """
         Put an object to the specified bucket in MinIO server. Default content type is `application/vnd.apache.parquet`.
 
         :param bucket_name: The name of the bucket to put the object in.
         :param object_name: The name of the object to put.
         :param buffer: A BytesIO or StringIO buffer containing the object data.
+        :param content_type: The content type of the object.
+        :return: True if the object was put, False if the server returned an error.
         """
         
         try:
@@ -107,10 +142,12 @@ class MinIO:
                 object_name=object_name,
                 data=buffer,
                 length=len(buffer.getvalue()),
-                content_type="application/vnd.apache.parquet"
+                content_type=content_type
             )
+            return True
         except S3Error as err:
             print(err)
+            return False
             
     def copy_object(self, src_bucket, src_object, dst_bucket, dst_object):
         """
@@ -0,0 +1,341 @@
+import pyarrow.parquet as pq
+import pyarrow as pa
+from sqlalchemy import inspect
+from sqlalchemy.types import Numeric
+from decimal import Decimal
+import struct
+import math
+import os
+
+PARQUET_MAGIC = b"PAR1"
+PARQUET_TAIL_SIZE = 8
+
+class Verification:
+    def __init__(self, db, minio):
+        """
+        Initialize Verification object.
+
+        The following environment variables are used to configure the verification:
+
+        - VERIFY_LOAD (default True): compare the source row count with the Parquet footer row count after each load.
+        - VERIFY_AGGREGATES (default False): also compare per-column non-null counts, and min/max for numeric
+          columns, with the Parquet column statistics.
+        - VERIFY_FAIL_ON_MISMATCH (default True): fail the run if a table is reported as "mismatch". A table
+          reported as "error" always fails the run.
+
+        :param db: An instance of utils.database.Database to handle database operations.
+        :param minio: An instance of script.minio.MinIO used to read the Parquet footers.
+        :return: None
+        """
+
+        self.db = db
+        self.minio = minio
+        self.enabled = self.str_to_bool(os.getenv("VERIFY_LOAD", "true"))
+        self.aggregates = self.str_to_bool(os.getenv("VERIFY_AGGREGATES", "false"))
+        self.fail_on_mismatch = self.str_to_bool(os.getenv("VERIFY_FAIL_ON_MISMATCH", "true"))
+
+    def str_to_bool(self, val):
+        return val.lower() in ("true", "yes", "1", "on")
+
+    def read_parquet_metadata(self, object_name):
+        """
+        Read the footer metadata of a Parquet object in MinIO server without downloading the data pages.
+
+        The object size is taken from a stat request, then two ranged GETs are used: one for the 8-byte tail
+        (footer length and magic bytes) and one for the footer itself.
+
+        :param object_name: The name of the Parquet object.
+        :return: A pyarrow.parquet.FileMetaData object, or None if the object does not exist.
+        :raises ValueError: If the object is not a valid Parquet file.
+        """
+
+        size = self.minio.stat_object(object_name)
+
+        if size is None:
+            return None
+
+        if size < PARQUET_TAIL_SIZE + len(PARQUET_MAGIC):
+            raise ValueError(f"Object {object_name} is too small to be a parquet file")
+
+        tail = self.minio.get_object_range(object_name, size - PARQUET_TAIL_SIZE, PARQUET_TAIL_SIZE)
+
+        if tail[4:] != PARQUET_MAGIC:
+            raise ValueError(f"Object {object_name} is not a parquet file")
+
+        footer_length = struct.unpack("<I", tail[:4])[0]
+        footer = self.minio.get_object_range(object_name, size - PARQUET_TAIL_SIZE - footer_length, footer_length)
+
+        # Only the footer is needed to parse the metadata, so wrap it in a minimal parquet file.
+        buffer = pa.BufferReader(PARQUET_MAGIC + footer + tail)
+
+        return pq.read_metadata(buffer)
+
+    def get_parquet_stats(self, metadata_list):
+        """
+        Aggregate row count and per-column statistics from a list of Parquet footers.
+
+        The output dictionary will be in the following format:
+
+        {
+            "row_count": 1000,
+            "columns": {
+                "column_name": {
+                    "non_null_count": 990,
+                    "min": 1,
+                    "max": 1000,
+                    "numeric": True
+                },
+                ...
+            }
+        }
+
+        Columns without statistics in any row group are left out of "columns". "min" and "max" are only set for
+        integer and floating point columns.
+
+        :param metadata_list: A list of pyarrow.parquet.FileMetaData objects.
+        :return: A dictionary containing the aggregated row count and column statistics.
+        """
+
+        output = {"row_count": 0, "columns": {}}
+        skipped = set()
+
+        for metadata in metadata_list:
+
+            output["row_count"] += metadata.num_rows
+
+            arrow_schema = metadata.schema.to_arrow_schema()
+
+            for rg_index in range(metadata.num_row_groups):
+
+                row_group = metadata.row_group(rg_index)
+
+                for col_index in range(row_group.num_columns):
+
+                    column = row_group.column(col_index)
+                    column_name = column.path_in_schema
+
+                    if column_name.startswith("__index_level_") or column_name in skipped:
+                        continue
+
+                    if column_name not in arrow_schema.names:
+                        skipped.add(column_name)
+                        continue
+
+                    statistics = column.statistics
+
+                    if statistics is None or not statistics.has_null_count:
+                        skipped.add(column_name)
+                        output["columns"].pop(column_name, None)
+                        continue
+
+                    field_type = arrow_schema.field(column_name).type
+                    numeric = pa.types.is_integer(field_type) or pa.types.is_floating(field_type)
+
+                    column_stats = output["columns"].setdefault(
+                        column_name,
+                        {"non_null_count": 0, "min": None, "max": None, "numeric": numeric}
+                    )
+
+                    column_stats["non_null_count"] += row_group.num_rows - statistics.null_count
+
+                    if numeric and statistics.has_min_max:
+                        if column_stats["min"] is None or statistics.min < column_stats["min"]:
+                            column_stats["min"] = statistics.min
+                        if column_stats["max"] is None or statistics.max > column_stats["max"]:
+                            column_stats["max"] = statistics.max
+
+        return output
+
+    def get_source_stats(self, table_name_query, columns=None, where_clause=None):
+        """
+        Get the row count, and optionally per-column aggregates, of the given table from the source database.
+
+        For every column in columns, the non-null count is selected, and for numeric columns the min and max
+        values are selected as well.
+
+        On PostgreSQL, NaN in float and numeric columns is counted as a value and sorts above every number, while
+        `Table.from_pandas` stores it as null. These columns are wrapped in NULLIF(column, 'NaN') so both sides
+        treat NaN as null.
+
+        :param table_name_query: The name of the table in the database to query.
+        :param columns: A dictionary of column name to numeric flag, or None to only select the row count.
+        :param where_clause: An optional SQL condition restricting the rows, matching the one used for the load.
+        :return: A dictionary in the same format as the output of `get_parquet_stats`.
+        """
+
+        columns = columns or {}
+        preparer = self.db.impl.engine.dialect.identifier_preparer
+
+        nan_columns = set()
+
+        if columns and self.db.impl.engine.dialect.name == "postgresql":
+            schema, table = table_name_query.split(".", 1)
+            with self.db.impl.throttle.query() as connection:
+                for column in inspect(connection).get_columns(table, schema):
+                    if isinstance(column["type"], Numeric):
+                        nan_columns.add(column["name"])
+
+        select_list = ["COUNT(*)"]
+
+        for column_name, numeric in columns.items():
+            quoted = preparer.quote(column_name)
+            if column_name in nan_columns:
+                quoted = f"NULLIF({quoted}, 'NaN')"
+            select_list.append(f"COUNT({quoted})")
+            if numeric:
+                select_list.append(f"MIN({quoted})")
+                select_list.append(f"MAX({quoted})")
+
+        query = f"SELECT {', '.join(select_list)} FROM {table_name_query}"
+
+        if where_clause:
+            query += f" WHERE {where_clause}"
+
+        with self.db.impl.throttle.query() as connection:
+            row = list(connection.exec_driver_sql(query).fetchone())
+
+        output = {"row_count": row.pop(0), "columns": {}}
+
+        for column_name, numeric in columns.items():
+            column_stats = {"non_null_count": row.pop(0), "min": None, "max": None, "numeric": numeric}
+            if numeric:
+                column_stats["min"] = row.pop(0)
+                column_stats["max"] = row.pop(0)
+            output["columns"][column_name] = column_stats
+
+        return output
+
+    def values_match(self, source_value, target_value):
+        """
+        Compare a source database value with a Parquet statistics value.
+
+        Floating point source values, and decimals with a fractional part, are compared allowing for float rounding.
+        Integer source values are compared exactly, so integers that lost precision in a float64 column (e.g. a
+        BIGINT chunk with a NULL) are reported as a mismatch.
+
+        :param source_value: The value from the source database.
+        :param target_value: The value from the Parquet statistics.
+        :return: True if the values match, False otherwise.
+        """
+
+        if source_value is None or target_value is None:
+            return source_value is None and target_value is None
+
+        if isinstance(source_value, float) or \
+                (isinstance(source_value, Decimal) and source_value != source_value.to_integral_value()):
+            return math.isclose(float(source_value), float(target_value), rel_tol=1e-9)
+
+        return source_value == target_value
+
+    def new_result(self, table_name_query, object_names):
+        """
+        Create the verification result of a table, in the format described in `verify_table`, with status "ok".
+
+        :param table_name_query: The name of the table in the database that was loaded.
+        :param object_names: A list of the object names written for the table during this run.
+        :return: A dictionary containing the verification result of the table.
+        """
+
+        return {
+            "table": table_name_query,
+            "status": "ok",
+            "objects": len(object_names),
+            "missing_objects": [],
+            "source_row_count": None,
+            "target_row_count": None,
+            "column_mismatches": {},
+            "error": None
+        }
+
+    def verify_table(self, table_name_query, object_names, where_clause=None, failed_uploads=None):
+        """
+        Verify that the Parquet objects written for a table match the source table.
+
+        The source row count is compared with the sum of the row counts in the Parquet footers. If
+        VERIFY_AGGREGATES is enabled, per-column non-null counts and numeric min/max values are compared as well.
+        Objects whose upload failed are reported as missing without being read, so an object with the same name
+        left by an earlier run is not verified in their place. Objects that are not found in MinIO are reported as
+        missing as well.
+
+        The output dictionary will be in the following format:
+
+        {
+            "table": "schema_name.table_name",
+            "status": "ok"|"mismatch"|"error",
+            "objects": 3,
+            "missing_objects": [],
+            "source_row_count": 25000,
+            "target_row_count": 25000,
+            "column_mismatches": {
+                "column_name": {"non_null_count": [990, 980]},
+                ...
+            },
+            "error": None
+        }
+
+        The source side is counted with the same where_clause as the load, so rows updated (incremental loads) or
+        inserted (full loads of tables with a single integer primary key) after the load started are excluded on
+        both sides.
+
+        :param table_name_query: The name of the table in the database that was loaded.
+        :param object_names: A list of the object names written for the table during this run.
+        :param where_clause: An optional SQL condition restricting the rows, matching the one used for the load.
+        :param failed_uploads: A list of the object names whose upload failed during this run.
+        :return: A dictionary containing the verification result of the table.
+        """
+
+        result = self.new_result(table_name_query, object_names)
+
+        try:
+            metadata_list = []
+
+            failed_uploads = set(failed_uploads or [])
+
+            for object_name in object_names:
+                if object_name in failed_uploads:
+                    result["missing_objects"].append(object_name)
+                    continue
+
+                metadata = self.read_parquet_metadata(object_name)
+
+                if metadata is None:
+                    result["missing_objects"].append(object_name)
+                else:
+                    metadata_list.append(metadata)
+
+            target_stats = self.get_parquet_stats(metadata_list)
+
+            if self.aggregates:
+                columns = {
+                    column_name: column_stats["numeric"]
+                    for column_name, column_stats in target_stats["columns"].items()
+                }
+            else:
+                columns = None
+
+            source_stats = self.get_source_stats(table_name_query, columns, where_clause)
+
+            result["source_row_count"] = source_stats["row_count"]
+            result["target_row_count"] = target_stats["row_count"]
+
+            for column_name, source_column in source_stats["columns"].items():
+
+                target_column = target_stats["columns"][column_name]
+                mismatches = {}
+
+                for key in ["non_null_count", "min", "max"]:
+                    if not self.values_match(source_column[key], target_column[key]):
+                        mismatches[key] = [str(source_column[key]), str(target_column[key])]
+
+                if mismatches:
+                    result["column_mismatches"][column_name] = mismatches
+
+            if result["missing_objects"] or result["column_mismatches"] or \
+                    result["source_row_count"] != result["target_row_count"]:
+                result["status"] = "mismatch"
+        except Exception as err:
+            print(err)
+            result["status"] = "error"
+            result["error"] = str(err)
+
+        return result
@@ -1,5 +1,6 @@
 import pandas as pd
 from sqlalchemy import create_engine, inspect
+from .throttle import Throttle
 import os
 
 class MsSQL:
@@ -18,6 +19,8 @@ class MsSQL:
 
         Create a SQLAlchemy engine object with the connection parameters.
 
+        Create a Throttle object to limit the load put on the database (see utils.throttle.Throttle).
+
         If DB_SCHEMA is not given, the schema will be "all". Otherwise, set self.schema to the given value.
         """
         
@@ -30,6 +33,17 @@ class MsSQL:
         
         self.engine = create_engine(f"mssql+pyodbc://{user}:{password}@{host}:{port}/{database}?driver=ODBC+Driver+18+for+SQL+Server&TrustServerCertificate=yes")
         
+        self.throttle = Throttle(
+            self.engine,
+            slot_queries=(
+                "SET NOCOUNT ON; DECLARE @result int; "
+                "EXEC @result = sp_getapplock @Resource = :name, @LockMode = 'Exclusive', "
+                "@LockOwner = 'Session', @LockTimeout = 0; "
+                "SELECT CASE WHEN @result >= 0 THEN 1 ELSE 0 END",
+                "EXEC sp_releaseapplock @Resource = :name, @LockOwner = 'Session'"
+            )
+        )
+        
         if schema:
             self.schema = schema
         else:
@@ -1,5 +1,6 @@
 import pandas as pd
 from sqlalchemy import create_engine, inspect
+from .throttle import Throttle
 import os
 
 class MySQL:
@@ -16,6 +17,8 @@ class MySQL:
 
         Create a SQLAlchemy engine object to connect to the MySQL database using the provided parameters.
 
+        Create a Throttle object to limit the load put on the database (see utils.throttle.Throttle).
+
         Initialize the schema attribute with the database name.
         """
 
@@ -27,6 +30,11 @@ class MySQL:
         
         self.engine = create_engine(f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}")
         
+        self.throttle = Throttle(
+            self.engine,
+            slot_queries=("SELECT GET_LOCK(:name, 0)", "SELECT RELEASE_LOCK(:name)")
+        )
+        
         self.schema = database
     
     def get_tables(self):
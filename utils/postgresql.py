@@ -1,5 +1,6 @@
 import pandas as pd
 from sqlalchemy import create_engine, inspect
+from .throttle import Throttle
 import os
 
 class Postgresql:
@@ -18,6 +19,8 @@ class Postgresql:
 
         Create a SQLAlchemy engine object with the connection parameters.
 
+        Create a Throttle object to limit the load put on the database (see utils.throttle.Throttle).
+
         If DB_SCHEMA is not given, the schema will be "all". Otherwise, set self.schema to the given value.
         """
         
@@ -30,6 +33,18 @@ class Postgresql:
         
         self.engine = create_engine(f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}")
         
+        # Replica lag in seconds. 0 on a replica that has replayed all received WAL, even if the primary had no
+        # writes for a while, and 0 on a primary where the WAL functions return NULL.
+        self.throttle = Throttle(
+            self.engine,
+            lag_query="SELECT COALESCE(CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                      "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END, 0)",
+            slot_queries=(
+                "SELECT pg_try_advisory_lock(hashtext(:name))",
+                "SELECT pg_advisory_unlock(hashtext(:name))"
+            )
+        )
+        
         if schema:
             self.schema = schema
         else:
@@ -0,0 +1,270 @@
+from contextlib import contextmanager
+from sqlalchemy import text
+import threading
+import time
+import os
+
+class Throttle:
+    def __init__(self, engine, lag_query=None, slot_queries=None):
+        """
+        Initialize the Throttle class.
+
+        Limit how hard the ingestion pulls from a source database. Get the throttle parameters from environment
+        variables. A value of 0 disables the corresponding limit.
+
+        - THROTTLE_ROWS_PER_SECOND (default 0)
+        - THROTTLE_BYTES_PER_SECOND (default 0)
+        - THROTTLE_MAX_CONCURRENT_QUERIES (default 0): maximum number of queries run at once against the source
+          by all ingestion processes, enforced with named database locks.
+        - THROTTLE_SLOT_NAME (default "bpns_throttle"): prefix of the lock names; processes sharing it share the
+          query slots.
+        - THROTTLE_SLOT_WAIT_SECONDS (default 1): seconds to wait before trying again when all slots are taken.
+        - THROTTLE_LATENCY_THRESHOLD_MS (default 0): back off when the probe query "SELECT 1" is slower.
+        - THROTTLE_LAG_THRESHOLD_SECONDS (default 0): back off when the replica lag is higher.
+        - THROTTLE_LAG_QUERY (optional): query returning the replica lag in seconds, overrides lag_query.
+        - THROTTLE_PROBE_INTERVAL (default 10): seconds between two probes.
+        - THROTTLE_BACKOFF_SECONDS (default 5): seconds to pause when a probe is over a threshold.
+        - THROTTLE_MIN_RATE_FACTOR (default 0.1): lowest fraction of the configured rates used while backing off.
+        - THROTTLE_MAX_BACKOFF_SECONDS (default 600): longest time to keep backing off before giving up.
+        - THROTTLE_ON_MAX_BACKOFF (default "continue"): "continue" to go on at the minimum rate once
+          THROTTLE_MAX_BACKOFF_SECONDS is reached, "fail" to raise an error.
+        - THROTTLE_MAX_CURSOR_PAUSE (default 30): longest single pause while a cursor is open on the source. It
+          must stay below the server and driver timeouts for idle cursors, e.g. net_write_timeout (60s) on MySQL.
+
+        Every probe over a threshold halves the rates, down to THROTTLE_MIN_RATE_FACTOR. Every healthy probe
+        raises them again by a tenth of the configured rates.
+
+        :param engine: The SQLAlchemy engine of the source database, used for the probe queries.
+        :param lag_query: The default query returning the replica lag in seconds for this database type.
+        :param slot_queries: A tuple of the queries to try to take and to release a named session lock given as
+        the :name parameter, for this database type. The first query must return a true value if the lock was taken.
+        """
+
+        self.engine = engine
+        self.rows_per_second = float(os.getenv("THROTTLE_ROWS_PER_SECOND", "0"))
+        self.bytes_per_second = float(os.getenv("THROTTLE_BYTES_PER_SECOND", "0"))
+        self.latency_threshold = float(os.getenv("THROTTLE_LATENCY_THRESHOLD_MS", "0")) / 1000
+        self.lag_threshold = float(os.getenv("THROTTLE_LAG_THRESHOLD_SECONDS", "0"))
+        self.lag_query = os.getenv("THROTTLE_LAG_QUERY", lag_query)
+        self.probe_interval = float(os.getenv("THROTTLE_PROBE_INTERVAL", "10"))
+        self.backoff_seconds = float(os.getenv("THROTTLE_BACKOFF_SECONDS", "5"))
+        self.min_rate_factor = float(os.getenv("THROTTLE_MIN_RATE_FACTOR", "0.1"))
+        self.max_backoff_seconds = float(os.getenv("THROTTLE_MAX_BACKOFF_SECONDS", "600"))
+        self.on_max_backoff = os.getenv("THROTTLE_ON_MAX_BACKOFF", "continue").lower()
+        self.max_cursor_pause = float(os.getenv("THROTTLE_MAX_CURSOR_PAUSE", "30"))
+        self.max_concurrent_queries = int(os.getenv("THROTTLE_MAX_CONCURRENT_QUERIES", "0"))
+        self.slot_name = os.getenv("THROTTLE_SLOT_NAME", "bpns_throttle")
+        self.slot_wait_seconds = float(os.getenv("THROTTLE_SLOT_WAIT_SECONDS", "1"))
+        self.slot_queries = slot_queries
+
+        self.lock = threading.Lock()
+        self.rate_factor = 1.0
+        self.row_tokens = self.rows_per_second
+        self.byte_tokens = self.bytes_per_second
+        self.last_refill = time.monotonic()
+        self.last_probe = 0.0
+        self.backoff_started = None
+        self.backoff_exhausted = False
+
+        if self.on_max_backoff not in ("continue", "fail"):
+            raise ValueError(f"Unsupported THROTTLE_ON_MAX_BACKOFF: {self.on_max_backoff}")
+
+        if self.max_concurrent_queries and not self.slot_queries:
+            raise ValueError("THROTTLE_MAX_CONCURRENT_QUERIES is not supported for this database type")
+
+    @property
+    def adaptive(self):
+        return bool(self.latency_threshold or (self.lag_threshold and self.lag_query))
+
+    @contextmanager
+    def query(self):
+        """
+        Context manager to wrap a query against the source database.
+
+        Wait for the source to be healthy if adaptive backoff is enabled, then for a free query slot if
+        THROTTLE_MAX_CONCURRENT_QUERIES is set, before running the query. A slot is a named session lock on the
+        source database, so the limit holds across every process and run against the same source. The lock is
+        held by the connection the query runs on. Probe queries do not take a slot.
+
+        :return: A SQLAlchemy connection to run the query on, closed when the context exits.
+        """
+
+        self.check_source()
+
+        with self.engine.connect() as connection:
+
+            if not self.max_concurrent_queries:
+                yield connection
+                return
+
+            slot = self.acquire_slot(connection)
+
+            try:
+                yield connection
+            finally:
+                try:
+                    connection.rollback()
+                    connection.execute(text(self.slot_queries[1]), {"name": slot})
+                    connection.commit()
+                except Exception as err:
+                    print(err)
+                    # Close the session instead of returning it to the pool, so its lock is released with it.
+                    connection.invalidate()
+
+    def acquire_slot(self, connection):
+        """
+        Take one of the THROTTLE_MAX_CONCURRENT_QUERIES named locks on the given connection, waiting
+        THROTTLE_SLOT_WAIT_SECONDS between tries while all of them are taken.
+
+        The transaction is committed after every try, so no transaction stays open while waiting. The locks are
+        session locks and are kept after the commit.
+
+        :param connection: The SQLAlchemy connection to take the lock on.
+        :return: The name of the lock taken.
+        """
+
+        while True:
+
+            for index in range(self.max_concurrent_queries):
+                slot = f"{self.slot_name}_{index}"
+                acquired = connection.execute(text(self.slot_queries[0]), {"name": slot}).scalar()
+                connection.commit()
+
+                if acquired:
+                    return slot
+
+            time.sleep(self.slot_wait_seconds)
+
+    def probe(self):
+        """
+        Probe the source database for its query latency and replica lag.
+
+        :return: A tuple of the latency of "SELECT 1" in seconds and the replica lag in seconds (None if no lag
+        query is set).
+        """
+
+        with self.engine.connect() as connection:
+            start = time.monotonic()
+            connection.execute(text("SELECT 1")).fetchall()
+            latency = time.monotonic() - start
+
+            lag = None
+            if self.lag_query:
+                lag = connection.execute(text(self.lag_query)).scalar()
+                lag = float(lag) if lag is not None else 0.0
+
+        return latency, lag
+
+    def check_source(self, max_pause=None):
+        """
+        Probe the source database if the probe interval has passed, and back off while it is over a threshold.
+
+        When a probe is over a threshold, the rates are halved and the caller sleeps THROTTLE_BACKOFF_SECONDS
+        before probing again. Once the source has been over a threshold since the first unhealthy probe for
+        THROTTLE_MAX_BACKOFF_SECONDS, across calls and on both the cursor and the no-cursor path, either
+        raise an error or go on at the minimum rate without sleeping until a probe is healthy again, depending on
+        THROTTLE_ON_MAX_BACKOFF.
+
+        If max_pause is given, a cursor is open on the source, so back off only once for at most max_pause seconds
+        and let the next call probe again.
+
+        :param max_pause: The longest time to sleep, or None if no cursor is open.
+        :raises RuntimeError: If THROTTLE_MAX_BACKOFF_SECONDS is reached and THROTTLE_ON_MAX_BACKOFF is "fail".
+        :return: None
+        """
+
+        if not self.adaptive:
+            return
+
+        while time.monotonic() - self.last_probe >= self.probe_interval:
+
+            self.last_probe = time.monotonic()
+            latency, lag = self.probe()
+
+            overloaded = (self.latency_threshold and latency > self.latency_threshold) or \
+                (self.lag_threshold and lag is not None and lag > self.lag_threshold)
+
+            with self.lock:
+                if overloaded:
+                    self.rate_factor = max(self.min_rate_factor, self.rate_factor / 2)
+                else:
+                    self.rate_factor = min(1.0, self.rate_factor + 0.1)
+
+            if not overloaded:
+                self.backoff_started = None
+                self.backoff_exhausted = False
+                return
+
+            if self.backoff_exhausted:
+                return
+
+            if self.backoff_started is None:
+                self.backoff_started = time.monotonic()
+
+            backoff_total = time.monotonic() - self.backoff_started
+
+            if backoff_total >= self.max_backoff_seconds:
+                if self.on_max_backoff == "fail":
+                    print(f"Source over threshold for {backoff_total:.0f}s, failing the load")
+                    raise RuntimeError(f"Source over threshold for {backoff_total:.0f}s (latency={latency:.3f}s, lag={lag}s)")
+
+                print(f"Source over threshold for {backoff_total:.0f}s, continuing at the minimum rate")
+                self.backoff_exhausted = True
+                return
+
+            if max_pause is not None:
+                print(f"Source over threshold (latency={latency:.3f}s, lag={lag}s), backing off for "
+                      f"{min(self.backoff_seconds, max_pause)}s with a cursor open")
+                time.sleep(min(self.backoff_seconds, max_pause))
+                return
+
+            print(f"Source over threshold (latency={latency:.3f}s, lag={lag}s), backing off for {self.backoff_seconds}s")
+            time.sleep(self.backoff_seconds)
+            self.last_probe = 0.0
+
+    def consume(self, rows, nbytes=0, max_pause=None):
+        """
+        Take the given number of rows and bytes from the token buckets, sleeping until they are refilled if the
+        buckets run out.
+
+        Each bucket holds at most one second worth of tokens, so a batch bigger than that is paid for by sleeping
+        after it has been read.
+
+        If max_pause is given, a cursor is open on the source, so the sleep is cut to max_pause seconds. The
+        remaining debt stays in the buckets and slows down the following batches.
+
+        :param rows: The number of rows that were read.
+        :param nbytes: The number of bytes that were read.
+        :param max_pause: The longest time to sleep, or None if no cursor is open.
+        :return: None
+        """
+
+        self.check_source(max_pause)
+
+        if not self.rows_per_second and not self.bytes_per_second:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.last_refill
+            self.last_refill = now
+
+            wait_seconds = 0.0
+
+            if self.rows_per_second:
+                rate = self.rows_per_second * self.rate_factor
+                self.row_tokens = min(self.rows_per_second, self.row_tokens + elapsed * rate) - rows
+                if self.row_tokens < 0:
+                    wait_seconds = max(wait_seconds, -self.row_tokens / rate)
+
+            if self.bytes_per_second:
+                rate = self.bytes_per_second * self.rate_factor
+                self.byte_tokens = min(self.bytes_per_second, self.byte_tokens + elapsed * rate) - nbytes
+                if self.byte_tokens < 0:
+                    wait_seconds = max(wait_seconds, -self.byte_tokens / rate)
+
+        if max_pause is not None:
+            wait_seconds = min(wait_seconds, max_pause)
+
+        if wait_seconds:
+            time.sleep(wait_seconds)